@@ -0,0 +1,22 @@
+# Объявления типов для сборки msg_split.py через Cython (см. setup.py).
+# Сам msg_split.py остаётся обычным Python-модулем и работает без сборки.
+
+cimport cython
+
+cdef class FragmentBuffer:
+    cdef public Py_ssize_t max_len
+    cdef public list chunks
+    cdef public Py_ssize_t remaining
+
+    @cython.locals(n=Py_ssize_t)
+    cpdef bint try_append(self, str s)
+    cpdef append(self, str s)
+    @cython.locals(space=Py_ssize_t, text_len=Py_ssize_t, end=Py_ssize_t)
+    cpdef Py_ssize_t fill(self, str text, Py_ssize_t idx)
+    cpdef reserve(self, Py_ssize_t n)
+    cpdef start(self, str prefix, Py_ssize_t reserved)
+    cpdef str flush(self)
+
+
+@cython.locals(n=Py_ssize_t)
+cpdef str format_attributes(list attrs)
@@ -1,246 +1,436 @@
-from typing import Generator, List, Tuple
-from bs4 import BeautifulSoup, NavigableString, Tag
+from collections import deque
+from html import escape
+from html.parser import HTMLParser
+from typing import Callable, Deque, Generator, Iterator, List, Optional, TextIO, Tuple
 
 MAX_LEN = 4096
 
-BLOCK_TAGS = {
+BLOCK_TAGS = frozenset({
     'p', 'b', 'strong', 'i', 'ul', 'ol', 'div', 'span'
-}
+})
+
+# Теги без закрывающей пары: для них html.parser не вызывает handle_endtag
+VOID_TAGS = frozenset({
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+})
+
+# Теги, внутри которых пробельный текст сохраняется как есть
+PRESERVE_WHITESPACE_TAGS = frozenset({'pre', 'textarea'})
+
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# Размер куска исходного текста, который за один раз отдаётся парсеру
+FEED_SIZE = 64 * 1024
 
 class SplitMessageError(Exception):
     """Исключение, выбрасываемое, если не удаётся уложить фрагмент в max_len."""
     pass
 
 
-def split_message(source: str, max_len: int = MAX_LEN) -> Generator[str, None, None]:
+class FragmentBuffer:
     """
-    Разделяет исходный HTML-текст (source) на фрагменты длиной не более max_len.
-    Каждый фрагмент содержит корректную структуру HTML (никакие неблочные теги не рвутся).
-    
-    Использует BeautifulSoup для парсинга, затем собирает строку частями.
+    Буфер текущего фрагмента: список кусков и оставшееся до max_len место.
+    Склеивание в строку происходит один раз - при выдаче фрагмента.
     """
 
-    soup = BeautifulSoup(source, 'html.parser')
+    def __init__(self, max_len: int):
+        self.max_len = max_len
+        self.chunks: List[str] = []
+        self.remaining = max_len
 
-    # Чтобы упростить: мы будем обходить дерево рекурсивно и генерировать "элементы" (теги или текст).
-    # При превышении max_len - закрываем открытые блочные теги и начинаем новый фрагмент.
-    # Если неблочный тег сам по себе больше max_len, кидаем ошибку.
+    def __bool__(self) -> bool:
+        return self.remaining < self.max_len
 
-    # Здесь мы храним текущий фрагмент (строку) и структуру вложенных блочных тегов.
-    current_fragment = ""
-    open_blocks_stack: List[str] = []  # Список имён тегов, которые открыты в текущем фрагменте
+    def try_append(self, s: str) -> bool:
+        """Добавить s, если он умещается в max_len. Вернуть False, если не умещается."""
+        n = len(s)
+        if n > self.remaining:
+            return False
+        self.chunks.append(s)
+        self.remaining -= n
+        return True
 
-    def open_block_tags(tags_stack: List[str]) -> str:
-        """Сформировать строку с открывающими тегами из списка."""
-        return "".join(f"<{tag}>" for tag in tags_stack)
+    def append(self, s: str):
+        """Добавить s без проверки: вызывающий уже убедился, что он влезает."""
+        self.chunks.append(s)
+        self.remaining -= len(s)
 
-    def close_block_tags(tags_stack: List[str]) -> str:
-        """Сформировать строку с закрывающими тегами из списка (в обратном порядке)."""
-        return "".join(f"</{tag}>" for tag in reversed(tags_stack))
+    def fill(self, text: str, idx: int) -> int:
+        """
+        Добавить из text, начиная с idx, столько, сколько влезает.
+        Вернуть позицию, с которой текст надо продолжить в следующем фрагменте.
+        """
+        space = self.remaining
+        if space <= 0:
+            return idx
+        text_len = len(text)
+        if space >= text_len - idx:
+            # Остаток текста влезает целиком
+            self.chunks.append(text[idx:] if idx else text)
+            self.remaining = space - (text_len - idx)
+            return text_len
+        # Остаток длиннее свободного места, поэтому кусок заполняет фрагмент до конца
+        end = idx + space
+        self.chunks.append(text[idx:end])
+        self.remaining = 0
+        return end
+
+    def reserve(self, n: int):
+        """Зарезервировать n символов (при отрицательном n - вернуть)."""
+        self.remaining -= n
+
+    def start(self, prefix: str, reserved: int):
+        """Начать новый фрагмент с prefix, оставив reserved символов под закрывающие теги."""
+        self.chunks = [prefix]
+        self.remaining = self.max_len - len(prefix) - reserved
+
+    def flush(self) -> str:
+        """Собрать накопленные куски в одну строку."""
+        return "".join(self.chunks)
+
+
+class MessageSplitter(HTMLParser):
+    """
+    Потоковый разбор HTML: по событиям парсера (открывающий тег, текст, закрывающий тег)
+    собирает фрагменты и передаёт готовые в emit (по умолчанию - в очередь fragments).
+    DOM-дерево при этом не строится - в памяти только стек открытых тегов.
+    """
 
-    def flush_fragment(fragment: str, close_tags: bool = True) -> str:
-        """Закрыть (при необходимости) блоки, вернуть готовую HTML-строку фрагмента."""
-        if close_tags:
-            return fragment + close_block_tags(open_blocks_stack)
-        else:
-            return fragment
+    def __init__(self, max_len: int = MAX_LEN, emit: Optional[Callable[[str], None]] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_len = max_len
+
+        # Готовые фрагменты, которые ещё не забрал split_message
+        self.fragments: Deque[str] = deque()
+        self.emit = emit if emit is not None else self.fragments.append
+
+        # Здесь мы храним текущий фрагмент (буфер кусков) и структуру вложенных блочных тегов.
+        self.buf = FragmentBuffer(max_len)
+        self.block_names: List[str] = []  # Имена открытых блочных тегов
+
+        # Для открытых блочных тегов храним уже склеенные строки: open_prefix_stack[-1] -
+        # все открывающие теги подряд, close_suffix_stack[-1] - все закрывающие в обратном порядке.
+        # Так при каждом разрыве фрагмента не нужно собирать их заново.
+        self.open_prefix_stack: List[str] = [""]
+        self.close_suffix_stack: List[str] = [""]
+
+        # Неблочный тег рвать нельзя, поэтому копим его вместе с содержимым
+        # до парного закрывающего тега и только потом добавляем целиком.
+        self.inline_names: List[str] = []  # Открытые теги внутри накапливаемого неблочного
+        self.inline_parts: Deque[str] = deque()
+        self.inline_length = 0
 
-    def yield_fragment(fragment: str):
-        """Отправить фрагмент наружу."""
-        nonlocal current_fragment
-        if fragment:
-            yield fragment
+        # Один текстовый участок парсер может отдать несколькими вызовами handle_data
+        # (например, на границе кусков FEED_SIZE). Копим их и обрабатываем целиком
+        # на следующем теге или в close(), чтобы результат не зависел от этих границ.
+        self.pending_data: List[str] = []
 
-    def safe_append(content: str):
+    def push_block(self, tag_name: str):
+        """
+        Запомнить открытый блочный тег.
+        Место под его закрывающий тег сразу вычитается из буфера: фрагмент, разорванный
+        внутри блока, закрывается close_suffix_stack[-1] и тоже должен уложиться в max_len.
+        """
+        self.block_names.append(tag_name)
+        self.open_prefix_stack.append(f"{self.open_prefix_stack[-1]}<{tag_name}>")
+        self.close_suffix_stack.append(f"</{tag_name}>{self.close_suffix_stack[-1]}")
+        self.buf.reserve(len(tag_name) + 3)
+
+    def pop_block(self):
+        """Забыть последний открытый блочный тег и вернуть зарезервированное под него место."""
+        tag_name = self.block_names.pop()
+        self.open_prefix_stack.pop()
+        self.close_suffix_stack.pop()
+        self.buf.reserve(-(len(tag_name) + 3))
+
+    def flush_fragment(self) -> str:
+        """Закрыть открытые блоки, вернуть готовую HTML-строку фрагмента."""
+        return self.buf.flush() + self.close_suffix_stack[-1]
+
+    def reopen_fragment(self):
+        """
+        Начать новый фрагмент с заново открытыми блочными тегами.
+        После этого в буфере только префикс, и свободно ровно max_len минус длина
+        префикса и зарезервированных закрывающих тегов.
+        """
+        self.buf.start(self.open_prefix_stack[-1], len(self.close_suffix_stack[-1]))
+
+    def safe_append(self, content: str):
         """Добавить content к текущему фрагменту, проверяя длину."""
-        nonlocal current_fragment
+        return self.buf.try_append(content)
 
-        if len(current_fragment) + len(content) > max_len:
-            return False
+    def handle_starttag(self, tag, attrs):
+        self.flush_data()
+        # Имена тегов и атрибутов HTMLParser уже приводит к нижнему регистру
+        if tag in VOID_TAGS:
+            open_tag_str = f"<{tag}{format_attributes(attrs)}/>"
         else:
-            current_fragment += content
-            return True
+            open_tag_str = f"<{tag}{format_attributes(attrs)}>"
+
+        if self.inline_names:
+            # Внутри неблочного тега всё копим как есть, блочные теги тоже
+            self.add_inline_part(open_tag_str)
+            if tag not in VOID_TAGS:
+                self.inline_names.append(tag)
+            return
+
+        if tag in BLOCK_TAGS:
+            self.open_block(tag, open_tag_str)
+        elif tag in VOID_TAGS:
+            # Пустой неблочный тег - уже готов целиком
+            self.append_inline(tag, open_tag_str)
+        else:
+            self.inline_names.append(tag)
+            self.add_inline_part(open_tag_str)
+
+    def handle_endtag(self, tag):
+        self.flush_data()
+        if self.inline_names:
+            if tag in self.inline_names:
+                self.close_inline_until(tag)
+                return
+            if tag not in self.block_names:
+                # Лишний закрывающий тег - пропускаем
+                return
+            # Закрывается блок, внутри которого остался незакрытый неблочный тег
+            self.finish_inline()
+
+        if tag in self.block_names:
+            # Закрываем все блоки до парного открывающего
+            while True:
+                tag_name = self.block_names[-1]
+                self.close_block(tag_name)
+                if tag_name == tag:
+                    break
+
+    def handle_data(self, data):
+        # HTMLParser уже раскодировал сущности (&lt; -> <): экранируем обратно, чтобы текст
+        # не превратился в разметку. Содержимое <script>/<style> приходит как есть.
+        if self.cdata_elem is None:
+            data = escape(data, quote=False)
+        self.pending_data.append(data)
+
+    def flush_data(self):
+        """Обработать накопленный текстовый участок целиком."""
+        if not self.pending_data:
+            return
+        data = "".join(self.pending_data)
+        self.pending_data.clear()
+
+        if not data.strip(ASCII_SPACES) and not PRESERVE_WHITESPACE_TAGS.intersection(self.inline_names):
+            # Пробельный текст между тегами сворачиваем до одного символа
+            data = "\n" if "\n" in data else " "
+
+        if self.inline_names:
+            self.add_inline_part(data)
+        else:
+            self.append_text(data)
 
-    def traverse(node):
+    def feed_in_chunks(self, source: str) -> Iterator[None]:
         """
-        Рекурсивный обход DOM. На каждом узле (Tag или NavigableString) 
-        пытаемся добавить его в текущий фрагмент.
+        Отдать парсеру весь source кусками по FEED_SIZE и закрыть его.
+        После каждого куска управление возвращается вызывающему, чтобы он мог забрать готовые фрагменты.
         """
-        nonlocal current_fragment
-
-        if isinstance(node, NavigableString):
-            # Просто текст
-            text_str = str(node)
-            if not text_str.strip():
-                # Если пустой текст - попробуем просто добавить (обычно не влияет на структуру)
-                if not safe_append(text_str):
-                    # Если даже пробел не влезает - фрагмент переполнен, 
-                    # надо завершить и начать новый
-                    # Закрываем текущие блоки:
-                    frag_to_yield = flush_fragment(current_fragment, close_tags=True)
-                    yield frag_to_yield
-                    current_fragment = ""
-                    # Открываем их заново
-                    current_fragment += open_block_tags(open_blocks_stack)
-                    # Теперь попробуем снова добавить:
-                    if not safe_append(text_str):
-                        # Если даже теперь не влезает, значит max_len слишком маленький
-                        raise SplitMessageError("Не удаётся добавить даже пустой текст.")
-                return
+        for start in range(0, len(source), FEED_SIZE):
+            self.feed(source[start: start + FEED_SIZE])
+            yield
+        self.close()
+        yield
+
+    def close(self):
+        """Дочитать остаток, закрыть все незакрытые теги и выдать последний фрагмент."""
+        super().close()
+        self.flush_data()
+
+        if self.inline_names:
+            self.finish_inline()
+        while self.block_names:
+            self.close_block(self.block_names[-1])
+
+        # В конце, если есть что-то в буфере, закрываем открытые теги и возвращаем
+        if self.buf:
+            final_fragment = self.flush_fragment()
+            self.emit(final_fragment)
+
+    def append_text(self, text_str: str):
+        """
+        Добавить текстовый узел, при необходимости разбив его между фрагментами.
+        Пробелы на границе фрагментов на вид не влияют, поэтому пробельный текст,
+        который не влез, и пробелы в начале нового фрагмента отбрасываются.
+        """
+        if not text_str:
+            return  # ничего добавлять не нужно
+
+        if not text_str.strip(ASCII_SPACES):
+            # Пробельный текст: если не влезает - просто отбрасываем, без разрыва фрагмента
+            self.safe_append(text_str)
+            return
+
+        # Здесь — логика разбивки: каждый раз добавляем столько текста, сколько влезает
+        buf = self.buf
+        # Всё, что после text_end, - пробелы: ради них новый фрагмент не начинаем
+        text_end = len(text_str.rstrip(ASCII_SPACES))
+        idx = buf.fill(text_str, 0)
+        while idx < text_end:
+            # Текущий фрагмент заполнен под завязку
+            # => "закрываем" и начинаем новый
+            frag_to_yield = self.flush_fragment()
+            self.emit(frag_to_yield)
+            self.reopen_fragment()
+            # В новом фрагменте место занимают только заново открытые блочные теги
+            if buf.remaining <= 0:
+                raise SplitMessageError("Открытые блочные теги не оставляют места для текста.")
+
+            # Пробелы в начале нового фрагмента не нужны (до text_end есть непробельный символ)
+            while text_str[idx] in ASCII_SPACES:
+                idx += 1
+
+            idx = buf.fill(text_str, idx)
+
+    def open_block(self, tag_name: str, open_tag_str: str):
+        """Добавить открывающий блочный тег (вместе с местом под закрывающий)."""
+        needed = len(open_tag_str) + len(tag_name) + 3
+        if needed > self.buf.remaining:
+            # Не влезает -> завершаем фрагмент
+            frag_to_yield = self.flush_fragment()
+            self.emit(frag_to_yield)
+            # Новый фрагмент
+            self.reopen_fragment()
+            # Теперь добавляем сам блок:
+            if needed > self.buf.remaining:
+                raise SplitMessageError(f"Тег <{tag_name}> сам по себе больше max_len.")
+
+        self.buf.append(open_tag_str)
+        self.push_block(tag_name)
+
+    def close_block(self, tag_name: str):
+        """Добавить закрывающий тег для последнего открытого блока."""
+        closing_tag_str = f"</{tag_name}>"
+
+        # Место под закрывающий тег зарезервировано ещё в push_block, поэтому он всегда влезает
+        self.buf.append(closing_tag_str)
+        # Удаляем из стека, так как тег успешно закрыт
+        self.pop_block()
+
+    def add_inline_part(self, part: str):
+        """Накопить кусок неблочного тега, не дожидаясь конца, если он уже больше max_len."""
+        self.inline_parts.append(part)
+        self.inline_length += len(part)
+        # Проверяем длину сразу
+        if self.inline_length > self.max_len:
+            raise SplitMessageError(
+                f"Тег <{self.inline_names[0]}> с содержимым больше max_len, разорвать нельзя."
+            )
+
+    def close_inline_until(self, tag: str):
+        """Закрыть теги внутри неблочного вплоть до tag; если закрыт сам неблочный - добавить его."""
+        while True:
+            tag_name = self.inline_names[-1]
+            # Снимаем тег со стека только после проверки длины: в сообщении об ошибке нужен внешний тег
+            self.add_inline_part(f"</{tag_name}>")
+            self.inline_names.pop()
+            if tag_name == tag:
+                break
+
+        if not self.inline_names:
+            self.flush_inline(tag)
+
+    def finish_inline(self):
+        """Закрыть все незакрытые теги накапливаемого неблочного тега и добавить его."""
+        root_name = self.inline_names[0]
+        # Закрываем всё до дна стека: тег с тем же именем может быть вложен в самого себя
+        while self.inline_names:
+            self.add_inline_part(f"</{self.inline_names[-1]}>")
+            self.inline_names.pop()
+
+        self.flush_inline(root_name)
+
+    def flush_inline(self, tag_name: str):
+        """Добавить накопленный неблочный тег в фрагмент и очистить накопление."""
+        self.append_inline(tag_name, "".join(self.inline_parts))
+        self.inline_parts.clear()
+        self.inline_length = 0
+
+    def append_inline(self, tag_name: str, full_str: str):
+        """Добавить неблочный тег целиком: рвать его нельзя."""
+        if len(full_str) > self.max_len:
+            raise SplitMessageError(
+                f"Тег <{tag_name}> с содержимым больше max_len, разорвать нельзя."
+            )
+
+        if not self.safe_append(full_str):
+            # Не влезает - завершим текущий фрагмент
+            frag_to_yield = self.flush_fragment()
+            self.emit(frag_to_yield)
+            # Новый фрагмент с уже открытыми блоками
+            self.reopen_fragment()
+            # Добавляем тег
+            if len(full_str) > self.buf.remaining:
+                raise SplitMessageError(
+                    f"Тег <{tag_name}> всё ещё не влезает в пустой фрагмент (слишком большой)."
+                )
+            self.buf.append(full_str)
 
-            # Проверяем, умещается ли этот текст целиком
-            if isinstance(node, NavigableString):
-                text_str = str(node)
-
-                if not text_str:  # или strip(), если совсем пустая
-                    return  # ничего добавлять не нужно
-
-                # Здесь — логика разбивки:
-                idx = 0
-                while idx < len(text_str):
-                    # Сколько осталось места в текущем фрагменте?
-                    space_in_fragment = max_len - len(current_fragment)
-                    if space_in_fragment <= 0:
-                        # Текущий фрагмент уже заполнен под завязку
-                        # => "закрываем" и начинаем новый
-                        frag_to_yield = flush_fragment(current_fragment, close_tags=True)
-                        yield frag_to_yield
-                        current_fragment = ""
-                        current_fragment += open_block_tags(open_blocks_stack)
-                        space_in_fragment = max_len  # новый фрагмент свободен
-
-                    # Возьмём кусок текста, который влезает в текущий фрагмент
-                    chunk = text_str[idx: idx + space_in_fragment]
-                    current_fragment += chunk
-                    idx += len(chunk)
 
-                return
+def split_message(source: str, max_len: int = MAX_LEN) -> Generator[str, None, None]:
+    """
+    Разделяет исходный HTML-текст (source) на фрагменты длиной не более max_len.
+    Каждый фрагмент содержит корректную структуру HTML (никакие неблочные теги не рвутся).
 
-            
-            if not safe_append(text_str):
-                # Не влезает - формируем готовый фрагмент
-                frag_to_yield = flush_fragment(current_fragment, close_tags=True)
-                yield frag_to_yield
-                current_fragment = ""
-
-                # Начинаем новый фрагмент с открытыми блок-тегами
-                current_fragment += open_block_tags(open_blocks_stack)
-                # Добавляем текст второй попыткой
-                if not safe_append(text_str):
-                    # Даже в пустой фрагмент не влезает => ошибка
-                    raise SplitMessageError("Текстовый узел больше max_len.")
-                
-        elif isinstance(node, Tag):
-            tag_name = node.name.lower()
-
-            # Проверим, является ли тег блочным или нет
-            is_block = (tag_name in BLOCK_TAGS)
-
-            # Открывающий тег
-            open_tag_str = f"<{tag_name}{format_attributes(node)}>"
-            closing_tag_str = f"</{tag_name}>"
-
-            if is_block:
-                if not safe_append(open_tag_str):
-                    # Не влезает -> завершаем фрагмент
-                    frag_to_yield = flush_fragment(current_fragment, close_tags=True)
-                    yield frag_to_yield
-                    current_fragment = ""
-                    # Новый фрагмент
-                    current_fragment += open_block_tags(open_blocks_stack)
-                    # Теперь добавляем сам блок:
-                    if not safe_append(open_tag_str):
-                        raise SplitMessageError(f"Тег <{tag_name}> сам по себе больше max_len.")
-                
-                open_blocks_stack.append(tag_name)
-
-                # Обойдём содержимое тега
-                for child in node.children:
-                    yield from traverse(child)
-
-                # Закрываем блочный тег
-                if not safe_append(closing_tag_str):
-                    # Не влезает - значит нужно завершить фрагмент 
-                    frag_to_yield = flush_fragment(current_fragment, close_tags=False)
-                    yield frag_to_yield
-                    current_fragment = ""
-                    # У нас ещё открыт текущий тег, но на новом фрагменте надо 
-                    # заново открыть все родительские.
-                    # Однако сам блочный тег мы можем закрыть целиком в старом фрагменте.
-                    # То есть, поскольку этот блочный тег "рвём" на фрагменты:
-                    open_blocks_stack.pop()  # удалить текущий
-                    
-                    # Закрываем именно текущий тег сейчас:
-                    leftover = closing_tag_str  # Тег, который не влез
-                    # Формируем завершённый фрагмент:
-                    if leftover:
-                        # Если leftover сам по себе больше max_len - ошибка
-                        if len(leftover) > max_len:
-                            raise SplitMessageError(f"Не удаётся закрыть <{tag_name}> в пределах max_len.")
-                        # Начинаем новый фрагмент
-                        current_fragment = open_block_tags(open_blocks_stack)  # те, что выше
-                        if not safe_append(leftover):
-                            # Если не влезает, снова дробим (редкий случай):
-                            raise SplitMessageError(f"Закрывающий тег </{tag_name}> не влезает в пустой фрагмент.")
-                    
-                    # Теперь считаем, что блочный тег заново "открываем" для дальнейшего содержимого?
-                    # Но мы уже обошли содержимое. Значит он полностью закрыт.
-                    # Возвращаемся к циклу. 
-                else:
-                    # Удаляем из стека, так как тег успешно закрыт
-                    open_blocks_stack.pop()
-
-            else:
-                # Неблочный тег рвать нельзя. Его содержимое должно уместиться целиком.
-                full_str = node.prettify(formatter=None)  # или вручную собрать <tag>...</tag>
-                # Проверяем длину сразу
-                if len(full_str) > max_len:
-                    raise SplitMessageError(
-                        f"Тег <{tag_name}> с содержимым больше max_len, разорвать нельзя."
-                    )
-
-                if not safe_append(full_str):
-                    # Не влезает - завершим текущий фрагмент
-                    frag_to_yield = flush_fragment(current_fragment, close_tags=True)
-                    yield frag_to_yield
-                    current_fragment = ""
-                    # Новый фрагмент с уже открытыми блоками
-                    current_fragment += open_block_tags(open_blocks_stack)
-                    # Добавляем тег
-                    if not safe_append(full_str):
-                        raise SplitMessageError(
-                            f"Тег <{tag_name}> всё ещё не влезает в пустой фрагмент (слишком большой)."
-                        )
+    Разбирает HTML потоково (html.parser.HTMLParser) и отдаёт фрагменты по мере готовности.
+    """
+
+    # При превышении max_len - закрываем открытые блочные теги и начинаем новый фрагмент.
+    # Если неблочный тег сам по себе больше max_len, кидаем ошибку.
+    parser = MessageSplitter(max_len)
+
+    for _ in parser.feed_in_chunks(source):
+        while parser.fragments:
+            yield parser.fragments.popleft()
 
-        else:
-            # На случай других типов узлов (Комментарии, Doctype, etc.) 
-            # Можно либо пропустить, либо обрабатывать аналогично тексту
-            pass
 
-    # Запускаем рекурсивный обход
-    for child in soup.children:
-        yield from traverse(child)
+def split_message_into(source: str, out: TextIO, max_len: int = MAX_LEN, sep: str = "\n---\n") -> int:
+    """
+    То же, что split_message, но фрагменты сразу пишутся в поток out (между ними - sep),
+    а не отдаются генератором. Возвращает число записанных фрагментов.
+    """
+    count = 0
+
+    def write_fragment(fragment: str):
+        nonlocal count
+        if count:
+            out.write(sep)
+        out.write(fragment)
+        count += 1
 
-    # В конце, если есть что-то в current_fragment, закрываем открытые теги и возвращаем
-    if current_fragment:
-        final_fragment = flush_fragment(current_fragment, close_tags=True)
-        yield final_fragment
+    parser = MessageSplitter(max_len, emit=write_fragment)
+    for _ in parser.feed_in_chunks(source):
+        pass
 
+    return count
 
-def format_attributes(tag: Tag) -> str:
+
+def format_attributes(attrs: List[Tuple[str, Optional[str]]]) -> str:
     """
-    Собрать строку атрибутов (например, key="value") из BeautifulSoup-тэга,
+    Собрать строку атрибутов (например, key="value") из списка пар, который отдаёт HTMLParser,
     чтобы корректно формировать открывающие теги вручную.
+    Значения приходят раскодированными, поэтому кавычки и & в них экранируются заново.
     """
-    if not tag.attrs:
+    n = len(attrs)
+    if n == 0:
         return ""
+    if n == 1:
+        # Самый частый случай - один атрибут, обходимся без списка и join
+        k, v = attrs[0]
+        if v is None:
+            return f" {k}"
+        return f' {k}="{escape(v)}"'
+
     parts = []
-    for k, v in tag.attrs.items():
+    for k, v in attrs:
         if v is None:
             parts.append(k)  # Например: <option disabled>
-        elif isinstance(v, list):
-            # Например, class=["btn","btn-primary"]
-            parts.append(f'{k}="{" ".join(v)}"')
         else:
-            parts.append(f'{k}="{v}"')
-    return " " + " ".join(parts) if parts else ""
+            parts.append(f'{k}="{escape(v)}"')
+    return " " + " ".join(parts)
@@ -0,0 +1,20 @@
+from setuptools import setup
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # Без Cython модуль работает как обычный .py
+    ext_modules = []
+else:
+    # Типы берутся из msg_split.pxd, аннотации в .py (int, List[...]) их не переопределяют
+    ext_modules = cythonize(
+        "msg_split.py",
+        compiler_directives={"language_level": 3, "annotation_typing": False},
+    )
+
+setup(
+    name="html-splitter",
+    py_modules=["msg_split", "split_msg"],
+    ext_modules=ext_modules,
+    install_requires=["click"],
+)
@@ -6,18 +6,17 @@ from msg_split import split_message, SplitMessageError
 @click.argument('html_file', type=click.Path(exists=True))
 def main(max_len, html_file):
     """Скрипт чтения HTML-файла и вывода фрагментов."""
-    with open(html_file, 'r', encoding='utf-8') as f:
-        source_html = f.read()
+    with open(html_file, 'rb') as f:
+        source_html = f.read().decode('utf-8')
 
+    # Фрагменты выводятся по мере готовности, не накапливаясь в памяти
     try:
-        fragments = list(split_message(source_html, max_len=max_len))
+        for i, fr in enumerate(split_message(source_html, max_len=max_len), 1):
+            click.echo(f"fragment #{i}: {len(fr)} chars")
+            click.echo(fr)
     except SplitMessageError as e:
         click.echo(f"ERROR: {e}")
         raise SystemExit(1)
 
-    for i, fr in enumerate(fragments, 1):
-        click.echo(f"fragment #{i}: {len(fr)} chars")
-        click.echo(fr)
-
 if __name__ == '__main__':
     main()
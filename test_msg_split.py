@@ -1,6 +1,7 @@
+import io
 import unittest
 
-from msg_split import split_message, SplitMessageError
+from msg_split import FEED_SIZE, split_message, split_message_into, SplitMessageError
 
 class TestSplitMessage(unittest.TestCase):
 
@@ -26,6 +27,11 @@ class TestSplitMessage(unittest.TestCase):
         with self.assertRaises(SplitMessageError):
             list(split_message(a_tag, max_len=4096))
 
+    def test_huge_tag_closing(self):
+        # Неблочный тег превышает max_len только вместе с закрывающим тегом
+        with self.assertRaises(SplitMessageError):
+            list(split_message("<code>" + "X" * 10 + "</code>", max_len=20))
+
     def test_block_tag_split(self):
         # Проверим, что блочный тег p при превышении лимита правильно "закрывается" и продолжается
         html = "<p>" + "A" * 3000 + "</p><p>" + "B" * 3000 + "</p>"
@@ -37,5 +43,93 @@ class TestSplitMessage(unittest.TestCase):
         self.assertTrue(fragments[0].endswith("</p>"), "Первый фрагмент должен корректно закрывать p.")
         self.assertTrue(fragments[1].startswith("<p>"), "Второй фрагмент должен начинаться с <p>.")
 
+    def test_fragments_fit_max_len(self):
+        # Закрывающие теги разорванных блоков тоже укладываются в max_len
+        html = "<div><p>" + "A" * 3000 + "</p><p>" + "B" * 3000 + "</p></div>"
+        fragments = list(split_message(html, max_len=4096))
+        self.assertGreater(len(fragments), 1)
+        for fragment in fragments:
+            self.assertLessEqual(len(fragment), 4096)
+
+    def test_long_block_reopened_in_every_fragment(self):
+        # Длинный текст внутри вложенных блоков: каждый фрагмент заново открывает и закрывает их
+        html = "<div><p>" + "A" * 1000 + "</p></div>"
+        fragments = list(split_message(html, max_len=100))
+        self.assertGreater(len(fragments), 10)
+        for fragment in fragments:
+            self.assertLessEqual(len(fragment), 100)
+            self.assertTrue(fragment.startswith("<div><p>A"))
+            self.assertTrue(fragment.endswith("A</p></div>"))
+        self.assertEqual(sum(fragment.count("A") for fragment in fragments), 1000)
+
+    def test_inline_tag_not_split(self):
+        # Неблочный тег вместе с вложенными тегами целиком переносится в следующий фрагмент
+        html = "<p>" + "A" * 30 + '<a href="u"><code>X</code><br></a></p>'
+        fragments = list(split_message(html, max_len=50))
+        self.assertEqual(len(fragments), 2)
+        self.assertEqual(fragments[1], '<p><a href="u"><code>X</code><br/></a></p>')
+
+    def test_unclosed_nested_inline_tag(self):
+        # Незакрытый неблочный тег, вложенный сам в себя, закрывается целиком
+        self.assertEqual(list(split_message("<a>x<a>y")), ["<a>x<a>y</a></a>"])
+
+        # ...и остаётся внутри своего блока, а текст после блока не теряется
+        fragments = list(split_message("<p><a>one<a>two</p>tail"))
+        self.assertEqual(fragments, ["<p><a>one<a>two</a></a></p>tail"])
+
+    def test_entities_and_quotes_escaped(self):
+        # Раскодированные парсером сущности и кавычки в атрибутах экранируются обратно
+        fragments = list(split_message("<a title='say \"hi\"'>x</a>"))
+        self.assertEqual(fragments, ['<a title="say &quot;hi&quot;">x</a>'])
+
+        fragments = list(split_message("<p>&lt;div&gt; &amp; x</p><code>&lt;b&gt;</code>"))
+        self.assertEqual(fragments, ["<p>&lt;div&gt; &amp; x</p><code>&lt;b&gt;</code>"])
+
+        # Содержимое <script> не экранируется
+        fragments = list(split_message("<script>if (a < b && c) {}</script>"))
+        self.assertEqual(fragments, ["<script>if (a < b && c) {}</script>"])
+
+    def test_text_across_feed_boundary(self):
+        # Текст, разрезанный границей куска FEED_SIZE, обрабатывается как один участок
+        html = "A" * (FEED_SIZE - 1) + "      <b>x</b>"
+        fragments = list(split_message(html, max_len=2 * FEED_SIZE))
+        self.assertEqual(fragments, [html])
+
+    def test_inline_tag_kept_verbatim(self):
+        # Неблочный тег выводится так, как записан, без переформатирования,
+        # включая сущности в тексте и экранированные кавычки в атрибутах
+        html = ('<a href="https://example.com/?a=1&amp;b=2" title="&quot;q&quot;">'
+                'see <code>&lt;div&gt; &amp; x</code> here</a>')
+        fragments = list(split_message(html, max_len=4096))
+        self.assertEqual(fragments, [html])
+
+    def test_deep_nesting(self):
+        # Глубокая вложенность блоков не упирается в лимит рекурсии
+        html = "<span>" * 2000 + "x" + "</span>" * 2000
+        fragments = list(split_message(html, max_len=30000))
+        self.assertEqual(fragments, [html])
+
+    def test_whitespace_at_fragment_boundary(self):
+        # Пробелы, не влезшие в фрагмент, отбрасываются: нового фрагмента ради них не будет
+        html = "<p>" + "A" * 10 + "</p>\n"
+        fragments = list(split_message(html, max_len=17))
+        self.assertEqual(fragments, ["<p>" + "A" * 10 + "</p>"])
+
+        # Пробелы в начале нового фрагмента тоже отбрасываются
+        fragments = list(split_message("A" * 10 + "  B", max_len=10))
+        self.assertEqual(fragments, ["A" * 10, "B"])
+
+        # Пробельный остаток текста после разрыва не порождает пустой фрагмент
+        fragments = list(split_message("<p>AAA  </p>", max_len=10))
+        self.assertEqual(fragments, ["<p>AAA</p>"])
+
+    def test_split_message_into(self):
+        # Запись в поток даёт те же фрагменты, что и генератор, через разделитель
+        html = "<p>" + "A" * 3000 + "</p><p>" + "B" * 3000 + "</p>"
+        out = io.StringIO()
+        count = split_message_into(html, out, max_len=4096, sep="|")
+        self.assertEqual(count, 2)
+        self.assertEqual(out.getvalue(), "|".join(split_message(html, max_len=4096)))
+
 if __name__ == '__main__':
     unittest.main()